@@ -48,6 +48,12 @@ rec_model=glintr100
 rec_ignore=False
 ## Maximum batch size for recognition model
 rec_batch_size=1
+## Time in ms to wait for faces from concurrent requests to fill recognition
+## batch. Increases throughput under load at cost of latency. Disabled if 0.
+rec_batch_timeout=0
+## Store normalized embeddings in FP16. Halves memory/storage size at cost of
+## some precision, cosine similarity is practically unaffected.
+embedding_fp16=False
 
 # GENDER/AGE MODELS:
 ## genderage_v1
@@ -109,6 +115,8 @@ for i in $(seq 0 $(($n_gpu - 1)) ); do
         -e REC_NAME=$rec_model\
         -e REC_IGNORE=$rec_ignore\
         -e REC_BATCH_SIZE=$rec_batch_size\
+        -e REC_BATCH_TIMEOUT=$rec_batch_timeout\
+        -e EMBEDDING_FP16=$embedding_fp16\
         -e GA_NAME=$ga_model\
         -e GA_IGNORE=$ga_ignore\
         -e TRITON_URI=$triton_uri\
@@ -39,7 +39,9 @@ processing = Processing(det_name=configs.models.det_name, rec_name=configs.model
                         max_rec_batch_size=configs.models.rec_batch_size,
                         backend_name=configs.models.backend_name,
                         force_fp16=configs.models.fp16,
-                        triton_uri=configs.models.triton_uri)
+                        triton_uri=configs.models.triton_uri,
+                        rec_batch_timeout=configs.models.rec_batch_timeout,
+                        embedding_fp16=configs.models.embedding_fp16)
 
 app = FastAPI(
     title="InsightFace-REST",
@@ -49,6 +51,11 @@ app = FastAPI(
     redoc_url=None
 )
 
+@app.on_event('shutdown')
+async def shutdown():
+    processing.close()
+
+
 @app.post('/extract', tags=['Detection & recognition'])
 async def extract(data: BodyExtract):
     """
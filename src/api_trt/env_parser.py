@@ -26,9 +26,11 @@ class Models:
         self.device = os.getenv("DEVICE", 'cuda')
         self.rec_name = os.getenv("REC_NAME", "arcface_r100_v1")
         self.rec_batch_size = int(os.getenv('REC_BATCH_SIZE', 1))
+        self.rec_batch_timeout = float(os.getenv('REC_BATCH_TIMEOUT', 0))
         self.det_name = os.getenv("DET_NAME", "retinaface_mnet025_v2")
         self.ga_name = os.getenv("GA_NAME", "genderage_v1")
         self.fp16 = tobool(os.getenv('FORCE_FP16', False))
+        self.embedding_fp16 = tobool(os.getenv('EMBEDDING_FP16', False))
         self.ga_ignore = tobool(os.getenv('GA_IGNORE', False))
         self.rec_ignore = tobool(os.getenv('REC_IGNORE', False))
         self.triton_uri = os.getenv("TRITON_URI", None)
@@ -45,6 +45,10 @@ def _build_engine_onnx(input_onnx: Union[str, bytes], force_fp16: bool = False,
                 print(parser.get_error(error))
             sys.exit(1)
 
+        if force_fp16 is True:
+            # Accept FP16 input directly, halving host to device transfer size.
+            # Outputs are kept in FP32 since they are small and postprocessing is precision sensitive.
+            network.get_input(0).dtype = trt.float16
 
         if max_batch_size != 1:
             logging.warning('Batch size !=1 is used. Ensure your inference code supports it.')
@@ -1,7 +1,6 @@
 import collections
 from typing import Dict, List, Optional
 import numpy as np
-from numpy.linalg import norm
 import cv2
 import logging
 
@@ -10,13 +9,12 @@ from modules.utils import face_align
 
 from modules.model_zoo.getter import get_model
 from modules.imagedata import ImageData
-from modules.utils.helpers import to_chunks
 
 import asyncio
 
-Face = collections.namedtuple(
-    "Face",
-    [
+# Mutable face container, updated in place while passing through pipeline
+class Face:
+    __slots__ = (
         "bbox",
         "landmark",
         "det_score",
@@ -29,10 +27,42 @@ Face = collections.namedtuple(
         "scale",
         "num_det",
         "mask_prob",
-    ],
-)
+    )
 
-Face.__new__.__defaults__ = (None,) * len(Face._fields)
+    def __init__(
+        self,
+        bbox=None,
+        landmark=None,
+        det_score=None,
+        embedding=None,
+        gender=None,
+        age=None,
+        embedding_norm=None,
+        normed_embedding=None,
+        facedata=None,
+        scale=None,
+        num_det=None,
+        mask_prob=None,
+    ):
+        self.bbox = bbox
+        self.landmark = landmark
+        self.det_score = det_score
+        self.embedding = embedding
+        self.gender = gender
+        self.age = age
+        self.embedding_norm = embedding_norm
+        self.normed_embedding = normed_embedding
+        self.facedata = facedata
+        self.scale = scale
+        self.num_det = num_det
+        self.mask_prob = mask_prob
+
+
+# Pending request in recognition micro-batching queue
+RecBatchItem = collections.namedtuple(
+    "RecBatchItem",
+    ["faces", "crops", "extract_embedding", "extract_ga", "return_face_data", "future"],
+)
 
 device2ctx = {"cpu": -1, "cuda": 0}
 
@@ -62,17 +92,25 @@ class Detector:
         )
         self.retina.prepare(ctx_id=device2ctx[device], nms=0.35)
 
-    def detect(self, data, threshold=0.3):
+        # Resolve once whether detector outputs mask probabilities and bind matching implementation
+        self.has_masks = getattr(self.retina, "masks", False) is True
+        if self.has_masks:
+            self.detect = self._detect_with_masks
+        else:
+            self.detect = self._detect_no_masks
+
+    def _detect_no_masks(self, data, threshold=0.3):
         bboxes, landmarks = self.retina.detect(data, threshold=threshold)
         boxes = bboxes[:, 0:4]
         probs = bboxes[:, 4]
-        mask_probs = None
-        try:
-            if self.retina.masks == True:
-                mask_probs = bboxes[:, 5]
-        except:
-            pass
-        t1 = time.time()
+        return boxes, probs, landmarks, None
+
+    def _detect_with_masks(self, data, threshold=0.3):
+        bboxes, landmarks = self.retina.detect(data, threshold=threshold)
+        boxes = bboxes[:, 0:4]
+        probs = bboxes[:, 4]
+        # Detector returns (0, 5) array without mask column when no faces found
+        mask_probs = bboxes[:, 5] if bboxes.shape[1] > 5 else None
         return boxes, probs, landmarks, mask_probs
 
 
@@ -88,6 +126,8 @@ class FaceAnalysis:
         backend_name: str = "mxnet",
         force_fp16: bool = False,
         triton_uri=None,
+        rec_batch_timeout: float = 0,
+        embedding_fp16: bool = False,
     ):
 
         if max_size is None:
@@ -95,6 +135,14 @@ class FaceAnalysis:
 
         self.max_size = max_size
         self.max_rec_batch_size = max_rec_batch_size
+        # Time in ms to wait for faces from concurrent requests to fill recognition batch.
+        # Disabled if 0.
+        self.rec_batch_timeout = rec_batch_timeout
+        self._rec_queue = None
+        self._rec_worker = None
+        self._rec_loop = None
+        # Store normed embeddings in FP16, halving their memory footprint
+        self.embedding_fp16 = embedding_fp16
         if backend_name not in ("trt", "triton") and max_rec_batch_size != 1:
             logging.warning(
                 "Batch processing supported only for TensorRT backend. Fallback to 1."
@@ -114,6 +162,13 @@ class FaceAnalysis:
             triton_uri=triton_uri,
         )
 
+        # If detector has input_shape attribute, use it instead of provided value
+        input_shape = getattr(self.det_model.retina, "input_shape", None)
+        if input_shape is not None:
+            self._det_max_size = tuple(input_shape[2:][::-1])
+        else:
+            self._det_max_size = None
+
         if rec_name is not None:
             self.rec_model = get_model(
                 rec_name,
@@ -141,101 +196,219 @@ class FaceAnalysis:
             self.ga_model = None
 
     @staticmethod
-    def sort_boxes(boxes, probs, landmarks, mask_probs, shape, max_num=0):
+    def sort_boxes(boxes, probs, landmarks, mask_probs, max_num=0):
         # Based on original InsightFace python package implementation
         if max_num > 0 and boxes.shape[0] > max_num:
+            # Keep largest faces first. Partial selection of top max_num faces is O(N),
+            # only selected faces are fully sorted.
             area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-            img_center = shape[0] // 2, shape[1] // 2
-            offsets = np.vstack(
-                [
-                    (boxes[:, 0] + boxes[:, 2]) / 2 - img_center[1],
-                    (boxes[:, 1] + boxes[:, 3]) / 2 - img_center[0],
-                ]
-            )
-            offset_dist_squared = np.sum(np.power(offsets, 2.0), 0)
-            values = area  # some extra weight on the centering
-            # some extra weight on the centering
-            bindex = np.argsort(values)[::-1]
-            bindex = bindex[0:max_num]
+            bindex = np.argpartition(-area, max_num - 1)[:max_num]
+            bindex = bindex[np.argsort(-area[bindex])]
 
             boxes = boxes[bindex, :]
             probs = probs[bindex]
-            if not isinstance(mask_probs, type(None)):
-                mask_probs = mask_probs[bindex, :]
+            if mask_probs is not None:
+                mask_probs = mask_probs[bindex]
 
             landmarks = landmarks[bindex, :]
 
         return boxes, probs, landmarks, mask_probs
 
-    # Translate bboxes and landmarks from resized to original image size
-    @staticmethod
-    def reproject_points(dets, scale: float):
-        if scale != 1.0:
-            dets = dets / scale
-        return dets
-
     def process_faces(
         self,
         faces: List[Face],
         extract_embedding: bool = True,
         extract_ga: bool = True,
         return_face_data: bool = False,
+        crops=None,
     ):
-        chunked_faces = to_chunks(faces, self.max_rec_batch_size)
-        for chunk in chunked_faces:
-            chunk = list(chunk)
-            crops = [e.facedata for e in chunk]
-            total = len(crops)
+        # If crops are provided separately, they are expected in same order as faces and
+        # are attached to faces as facedata only when requested.
+        # Skip models which are not loaded
+        extract_embedding = extract_embedding and self.rec_model is not None
+        extract_ga = extract_ga and self.ga_model is not None
+
+        if not isinstance(faces, list):
+            faces = list(faces)
+        for offset in range(0, len(faces), self.max_rec_batch_size):
+            chunk = faces[offset:offset + self.max_rec_batch_size]
+            total = len(chunk)
+            if crops is None:
+                chunk_crops = [e.facedata for e in chunk]
+            else:
+                chunk_crops = crops[offset:offset + total]
             embeddings = [None] * total
+            embedding_norms = [None] * total
+            normed_embeddings = [None] * total
             ga = [[None, None]] * total
 
+            # Pack BGR crops into single contiguous RGB NCHW batch, shared by recognition and genderage models
+            if extract_embedding or extract_ga:
+                blob = cv2.dnn.blobFromImages(chunk_crops, size=(112, 112), swapRB=True)
+                blob = np.ascontiguousarray(blob, dtype=np.float32)
+
             if extract_embedding:
                 t0 = time.time()
-                embeddings = self.rec_model.get_embedding(crops)
+                embeddings = np.asarray(self.rec_model.get_embedding(blob), dtype=np.float32)
+                # L2-normalize whole batch at once instead of per face
+                embedding_norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+                normed_embeddings = embeddings / embedding_norms[:, None]
+                if self.embedding_fp16:
+                    normed_embeddings = normed_embeddings.astype(np.float16)
                 t1 = time.time()
                 took = t1 - t0
                 logging.debug(
-                    f"Embedding {total} faces took: {took} ({took / total} per face)"
+                    "Embedding %s faces took: %s (%s per face)", total, took, took / total
                 )
 
             if extract_ga:
                 t0 = time.time()
-                ga = self.ga_model.get(crops)
+                ga = self.ga_model.get(blob)
                 t1 = time.time()
                 took = t1 - t0
                 logging.debug(
-                    f"Extracting g/a for {total} faces took: {took} ({took / total} per face)"
+                    "Extracting g/a for %s faces took: %s (%s per face)", total, took, took / total
                 )
 
-            for i, crop in enumerate(crops):
-                embedding = None
-                embedding_norm = None
-                normed_embedding = None
+            for i, face in enumerate(chunk):
                 gender = None
                 age = None
 
                 embedding = embeddings[i]
-                if extract_embedding:
-                    embedding_norm = norm(embedding)
-                    normed_embedding = embedding / embedding_norm
+                embedding_norm = embedding_norms[i]
+                normed_embedding = normed_embeddings[i]
                 _ga = ga[i]
                 if extract_ga:
                     gender = int(_ga[0])
                     age = _ga[1]
 
-                face = chunk[i]
                 if return_face_data is False:
-                    face = face._replace(facedata=None)
-
-                face = face._replace(
-                    embedding=embedding,
-                    embedding_norm=embedding_norm,
-                    normed_embedding=normed_embedding,
-                    gender=gender,
-                    age=age,
-                )
+                    face.facedata = None
+                elif crops is not None:
+                    face.facedata = chunk_crops[i]
+
+                face.embedding = embedding
+                face.embedding_norm = embedding_norm
+                face.normed_embedding = normed_embedding
+                face.gender = gender
+                face.age = age
                 yield face
 
+    # Coalesce faces from concurrent requests into shared recognition batches
+    async def process_faces_batched(
+        self,
+        faces: List[Face],
+        crops,
+        extract_embedding: bool = True,
+        extract_ga: bool = True,
+        return_face_data: bool = False,
+    ):
+        loop = asyncio.get_running_loop()
+        # (Re)start worker if it wasn't started yet, has exited or belongs to another event loop
+        if self._rec_worker is None or self._rec_worker.done() or self._rec_loop is not loop:
+            self.stop_rec_worker()
+            self._rec_loop = loop
+            self._rec_queue = asyncio.Queue()
+            self._rec_worker = asyncio.ensure_future(self._rec_batch_worker(self._rec_queue))
+        future = loop.create_future()
+        await self._rec_queue.put(
+            RecBatchItem(faces, crops, extract_embedding, extract_ga, return_face_data, future)
+        )
+        return await future
+
+    # Cancel micro-batching worker, should be called on shutdown.
+    # Requests still waiting in queue are failed instead of left hanging.
+    def stop_rec_worker(self):
+        if self._rec_worker is not None and not self._rec_worker.done():
+            if self._rec_loop is not None and not self._rec_loop.is_closed():
+                self._rec_worker.cancel()
+        if self._rec_queue is not None:
+            items = []
+            while not self._rec_queue.empty():
+                items.append(self._rec_queue.get_nowait())
+            self._fail_rec_items(items)
+        self._rec_worker = None
+        self._rec_queue = None
+        self._rec_loop = None
+
+    @staticmethod
+    def _fail_rec_items(items):
+        for item in items:
+            future = item.future
+            if not future.done() and not future.get_loop().is_closed():
+                future.set_exception(RuntimeError("Recognition batching worker stopped"))
+
+    async def _rec_batch_worker(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        timeout = self.rec_batch_timeout / 1000
+        items, pending = [], []
+        try:
+            while True:
+                if not pending:
+                    pending.append(await queue.get())
+                # Requests which would overflow batch are held for the next round. First request is
+                # always taken, even if it exceeds batch size alone.
+                items, held, total = [], [], 0
+                for item in pending:
+                    if items and total + len(item.faces) > self.max_rec_batch_size:
+                        held.append(item)
+                    else:
+                        items.append(item)
+                        total += len(item.faces)
+                pending = held
+                deadline = loop.time() + timeout
+                while total < self.max_rec_batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if total + len(item.faces) > self.max_rec_batch_size:
+                        pending.append(item)
+                        continue
+                    items.append(item)
+                    total += len(item.faces)
+                logging.debug("Recognition batch collected %s faces from %s requests", total, len(items))
+
+                # Requests asking for different outputs are processed in separate groups
+                groups = {}
+                for item in items:
+                    groups.setdefault((item.extract_embedding, item.extract_ga), []).append(item)
+
+                for (extract_embedding, extract_ga), group in groups.items():
+                    try:
+                        faces = [face for item in group for face in item.faces]
+                        crops = np.concatenate([item.crops for item in group])
+                        faces = list(
+                            self.process_faces(
+                                faces,
+                                extract_embedding=extract_embedding,
+                                extract_ga=extract_ga,
+                                return_face_data=True,
+                                crops=crops,
+                            )
+                        )
+                    except Exception as e:
+                        for item in group:
+                            if not item.future.done():
+                                item.future.set_exception(e)
+                        continue
+
+                    offset = 0
+                    for item in group:
+                        result = faces[offset:offset + len(item.faces)]
+                        offset += len(item.faces)
+                        if item.return_face_data is False:
+                            for face in result:
+                                face.facedata = None
+                        if not item.future.done():
+                            item.future.set_result(result)
+        finally:
+            # Don't leave requests hanging if worker is cancelled or fails
+            self._fail_rec_items(items + pending)
+
     # Process single image
     async def get(
         self,
@@ -248,29 +421,25 @@ class FaceAnalysis:
         limit_faces: int = 0,
     ):
 
-        ts = time.time()
-        t0 = time.time()
+        ts = t0 = time.time()
 
-        # If detector has input_shape attribute, use it instead of provided value
-        try:
-            max_size = self.det_model.retina.input_shape[2:][::-1]
-        except:
-            pass
+        if self._det_max_size is not None:
+            max_size = self._det_max_size
 
         img = ImageData(img, max_size=max_size)
         img.resize_image(mode="pad")
         t1 = time.time()
-        logging.debug(f"Preparing image took: {t1 - t0}")
+        logging.debug("Preparing image took: %s", t1 - t0)
 
         t0 = time.time()
         boxes, probs, landmarks, mask_probs = self.det_model.detect(
             img.transformed_image, threshold=threshold
         )
         t1 = time.time()
-        logging.debug(f"Detection took: {t1 - t0}")
+        logging.debug("Detection took: %s", t1 - t0)
         faces = []
         await asyncio.sleep(0)
-        if not isinstance(boxes, type(None)):
+        if boxes is not None:
             t0 = time.time()
             if limit_faces > 0:
                 boxes, probs, landmarks, mask_probs = self.sort_boxes(
@@ -278,22 +447,36 @@ class FaceAnalysis:
                     probs,
                     landmarks,
                     mask_probs,
-                    shape=img.transformed_image.shape,
                     max_num=limit_faces,
                 )
+            # Translate bboxes and landmarks from resized to original image size, for all faces at once
+            if img.scale_factor != 1.0:
+                boxes = boxes / img.scale_factor
+                landmarks = landmarks / img.scale_factor
+            need_rec = (extract_embedding and self.rec_model is not None) or (
+                extract_ga and self.ga_model is not None
+            )
+            # Crop faces from original image instead of resized to improve quality.
+            # Cropping is CPU bound and releases GIL, so run it in worker thread to let event loop
+            # proceed with GPU inference for concurrent requests meanwhile.
+            # Crops aren't needed at all if neither recognition outputs nor face data are requested.
+            if len(boxes) > 0 and (need_rec or return_face_data):
+                loop = asyncio.get_running_loop()
+                crops = await loop.run_in_executor(
+                    None, face_align.norm_crop_batched, img.orig_image, landmarks
+                )
+            else:
+                crops = [None] * len(boxes)
             for i in range(len(boxes)):
-                # Translate points to original image size
-                bbox = self.reproject_points(boxes[i], img.scale_factor)
-                landmark = self.reproject_points(landmarks[i], img.scale_factor)
+                bbox = boxes[i]
+                landmark = landmarks[i]
                 det_score = probs[i]
 
-                if not isinstance(mask_probs, type(None)):
+                if mask_probs is not None:
                     mask_prob = mask_probs[i]
                 else:
                     mask_prob = None
 
-                # Crop faces from original image instead of resized to improve quality
-                _crop = face_align.norm_crop(img.orig_image, landmark=landmark)
                 face = Face(
                     bbox=bbox,
                     landmark=landmark,
@@ -301,24 +484,32 @@ class FaceAnalysis:
                     num_det=i,
                     scale=img.scale_factor,
                     mask_prob=mask_prob,
-                    facedata=_crop,
                 )
 
                 faces.append(face)
 
             t1 = time.time()
-            logging.debug(f"Cropping {len(boxes)} faces took: {t1 - t0}")
+            logging.debug("Cropping %s faces took: %s", len(boxes), t1 - t0)
 
             # Process detected faces
-            faces = list(
-                self.process_faces(
+            if self.rec_batch_timeout > 0 and faces and need_rec:
+                faces = await self.process_faces_batched(
                     faces,
+                    crops,
                     extract_embedding=extract_embedding,
                     extract_ga=extract_ga,
                     return_face_data=return_face_data,
                 )
-            )
+            else:
+                faces = list(
+                    self.process_faces(
+                        faces,
+                        extract_embedding=extract_embedding,
+                        extract_ga=extract_ga,
+                        return_face_data=return_face_data,
+                        crops=crops,
+                    )
+                )
 
-        tf = time.time()
-        logging.debug(f"Full processing took: {tf - ts}")
+        logging.debug("Full processing took: %s", time.time() - ts)
         return faces
@@ -1,5 +1,6 @@
 from typing import List
 import cv2
+import numpy as np
 
 class ImageData:
     def __init__(self, image, max_size: List[int] = None):
@@ -31,16 +32,19 @@ class ImageData:
             if self.scale_factor > 3:
                 self.scale_factor = self.scale_factor * 0.7
 
-            self.transformed_image = cv2.resize(self.transformed_image, (0, 0), fx=self.scale_factor, fy=self.scale_factor,
-                                                interpolation=cv2.INTER_LINEAR)
+            if self.scale_factor != 1.0:
+                self.transformed_image = cv2.resize(self.transformed_image, (0, 0), fx=self.scale_factor,
+                                                    fy=self.scale_factor, interpolation=cv2.INTER_LINEAR)
             if pad:
-                # # Pad right and bottom with black border for fixed image proportions
+                # Pad right and bottom with black border for fixed image proportions.
+                # Image is copied once into zero filled canvas instead of padding each side separately.
                 h, w, _ = self.transformed_image.shape
+                if w < cw or h < ch:
+                    canvas = np.zeros((max(h, ch), max(w, cw)) + self.transformed_image.shape[2:],
+                                      dtype=self.transformed_image.dtype)
+                    canvas[:h, :w] = self.transformed_image
+                    self.transformed_image = canvas
                 if w < cw:
-                    self.transformed_image = cv2.copyMakeBorder(self.transformed_image, 0, 0, 0, cw - w,
-                                                                cv2.BORDER_CONSTANT)
                     self.left_border = cw - w
                 if h < ch:
-                    self.transformed_image = cv2.copyMakeBorder(self.transformed_image, 0, ch - h, 0, 0,
-                                                                cv2.BORDER_CONSTANT)
                     self.bottom_border = ch - h
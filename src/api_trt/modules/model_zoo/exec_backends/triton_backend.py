@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 import os
 import sys
 import argparse
@@ -110,17 +109,8 @@ class Arcface:
 
 
 
+    # Expects batch of RGB face crops packed into NCHW float32 tensor
     def get_embedding(self,face_img):
-
-        if not isinstance(face_img, list):
-            face_img = [face_img]
-        for i, img in enumerate(face_img):
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img = np.transpose(img, (2, 0, 1))
-            face_img[i] = img
-
-        face_img = np.stack(face_img)
-
         face_img = face_img.astype(triton_to_np_dtype(self.dtype))
 
         inputs = []
@@ -185,17 +175,9 @@ class Cosface:
 
         
 
+    # Expects batch of RGB face crops packed into NCHW float32 tensor
     def get_embedding(self, face_img):
-        if not isinstance(face_img, list):
-            face_img = [face_img]
-
-        for i, img in enumerate(face_img):
-            input_size = tuple(img.shape[0:2][::-1])
-            blob = cv2.dnn.blobFromImage(img, 1.0 / self.input_std, input_size,
-                                         (self.input_mean, self.input_mean, self.input_mean), swapRB=True)[0]
-            face_img[i] = blob
-
-        face_img = np.stack(face_img)
+        face_img = (face_img - self.input_mean) / self.input_std
         face_img = face_img.astype(triton_to_np_dtype(self.dtype))
         
         
@@ -1,5 +1,4 @@
 import os
-import cv2
 import numpy as np
 import time
 import logging
@@ -27,15 +26,8 @@ class Arcface:
         logging.info(
             f"Engine warmup complete! Expecting input shape: {self.input_shape}. Max batch size: {self.max_batch_size}")
 
+    # Expects batch of RGB face crops packed into NCHW float32 tensor
     def get_embedding(self, face_img):
-        if not isinstance(face_img, list):
-            face_img = [face_img]
-        if not face_img[0].shape == (3, 112, 112):
-            for i, img in enumerate(face_img):
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                img = np.transpose(img, (2, 0, 1))
-                face_img[i] = img
-            face_img = np.stack(face_img)
         embeddings = self.rec_model.run(face_img, deflatten=True)[0]
         return embeddings
 
@@ -61,16 +53,9 @@ class Cosface:
         logging.info(
             f"Engine warmup complete! Expecting input shape: {self.input_shape}. Max batch size: {self.max_batch_size}")
 
+    # Expects batch of RGB face crops packed into NCHW float32 tensor
     def get_embedding(self, face_img):
-        if not isinstance(face_img, list):
-            face_img = [face_img]
-
-        for i, img in enumerate(face_img):
-            input_size = tuple(img.shape[0:2][::-1])
-            blob = cv2.dnn.blobFromImage(img, 1.0 / self.input_std, input_size,
-                                         (self.input_mean, self.input_mean, self.input_mean), swapRB=True)[0]
-            face_img[i] = blob
-        face_img = np.stack(face_img)
+        face_img = (face_img - self.input_mean) / self.input_std
         embeddings = self.rec_model.run(face_img, deflatten=True)[0]
         return embeddings
 
@@ -95,28 +80,14 @@ class FaceGenderage:
         logging.info(
             f"Engine warmup complete! Expecting input shape: {self.input_shape}. Max batch size: {self.max_batch_size}")
 
+    # Expects batch of RGB face crops packed into NCHW float32 tensor
     def get(self, face_img):
-        if not isinstance(face_img, list):
-            face_img = [face_img]
-
-        if not face_img[0].shape == (3, 112, 112):
-            for i, img in enumerate(face_img):
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                img = np.transpose(img, (2, 0, 1))
-                face_img[i] = img
-            face_img = np.stack(face_img)
-
-        _ga = []
         ret = self.rec_model.run(face_img, deflatten=True)[0]
-        for e in ret:
-            e = np.expand_dims(e, axis=0)
-            g = e[:, 0:2].flatten()
-            gender = np.argmax(g)
-            a = e[:, 2:202].reshape((100, 2))
-            a = np.argmax(a, axis=1)
-            age = int(sum(a))
-            _ga.append((gender, age))
-        return _ga
+        # Decode gender and age for whole batch at once
+        ret = ret.reshape(ret.shape[0], -1)
+        gender = np.argmax(ret[:, 0:2], axis=1)
+        age = np.argmax(ret[:, 2:202].reshape((-1, 100, 2)), axis=2).sum(axis=1)
+        return list(zip(gender.tolist(), age.tolist()))
 
 
 class DetectorInfer:
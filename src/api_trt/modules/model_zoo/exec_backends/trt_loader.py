@@ -53,13 +53,16 @@ def allocate_buffers(engine):
 
 # This function is generalized for multiple inputs/outputs.
 # inputs and outputs are expected to be lists of HostDeviceMem objects.
-def do_inference(context, bindings, inputs, outputs, stream):
+# Buffers are allocated for max_batch_size, but only part used by current batch is transferred.
+def do_inference(context, bindings, inputs, outputs, stream, batch_size: int = 1, max_batch_size: int = 1):
     # Transfer input data to the GPU.
-    [cuda.memcpy_htod_async(inp.device, inp.host, stream) for inp in inputs]
+    [cuda.memcpy_htod_async(inp.device, inp.host[:inp.host.size // max_batch_size * batch_size], stream)
+     for inp in inputs]
     # Run inference.
     context.execute_async_v2(bindings=bindings, stream_handle=stream.handle)
     # Transfer predictions back from the GPU.
-    [cuda.memcpy_dtoh_async(out.host, out.device, stream) for out in outputs]
+    [cuda.memcpy_dtoh_async(out.host[:out.host.size // max_batch_size * batch_size], out.device, stream)
+     for out in outputs]
     # Synchronize the stream
     stream.synchronize()
     # Return only the host outputs.
@@ -96,11 +99,14 @@ class TrtModel(object):
         input = np.asarray(input)
         batch_size = input.shape[0]
         allocate_place = np.prod(input.shape)
-        self.inputs[0].host[:allocate_place] = input.flatten(order='C').astype(np.float32)
+        # Write directly into persistent pinned buffer, casting to engine input precision
+        # (FP16 for engines built with force_fp16) without intermediate copies
+        np.copyto(self.inputs[0].host[:allocate_place].reshape(input.shape), input, casting='unsafe')
         self.context.set_binding_shape(0, input.shape)
         trt_outputs = do_inference(
             self.context, bindings=self.bindings,
-            inputs=self.inputs, outputs=self.outputs, stream=self.stream)
+            inputs=self.inputs, outputs=self.outputs, stream=self.stream,
+            batch_size=batch_size, max_batch_size=self.max_batch_size)
         #Reshape TRT outputs to original shape instead of flattened array
         if deflatten:
             trt_outputs = [output.reshape(shape) for output, shape in zip(trt_outputs, self.out_shapes)]
@@ -178,6 +178,8 @@ class Processing:
         max_rec_batch_size: int = 1,
         force_fp16: bool = False,
         triton_uri=None,
+        rec_batch_timeout: float = 0,
+        embedding_fp16: bool = False,
     ):
 
         if max_size is None:
@@ -197,8 +199,14 @@ class Processing:
             backend_name=backend_name,
             force_fp16=force_fp16,
             triton_uri=triton_uri,
+            rec_batch_timeout=rec_batch_timeout,
+            embedding_fp16=embedding_fp16,
         )
 
+    # Release background resources, should be called on shutdown
+    def close(self):
+        self.model.stop_rec_worker()
+
     @staticmethod
     def __iterate_faces(crops):
         for face in crops:
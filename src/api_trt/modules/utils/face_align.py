@@ -71,6 +71,61 @@ def norm_crop(img, landmark, image_size=112, mode='arcface'):
     warped = cv2.warpAffine(img, M, (image_size, image_size), borderValue=0.0)
     return warped
 
+
+# Batched version of estimate_norm: solves Umeyama similarity transform for all (N, 5, 2) landmarks
+# against all templates at once with broadcasting, instead of calling SimilarityTransform per face.
+# Returns (N, 2, 3) transforms and (N,) indices of best matching templates.
+def estimate_norm_batched(lmks, image_size=112, mode='arcface'):
+    assert lmks.ndim == 3 and lmks.shape[1:] == (5, 2)
+    if mode == 'arcface':
+        assert image_size == 112
+        src = arcface_src
+    else:
+        src = src_map[image_size]
+    lmks = lmks.astype(np.float64)
+    # Shapes are broadcast to (N, T, ...), where T is number of templates
+    lmk = lmks[:, None]
+    dst = src[None].astype(np.float64)
+
+    lmk_mean = lmk.mean(axis=2)
+    dst_mean = dst.mean(axis=2)
+    lmk_demean = lmk - lmk_mean[:, :, None]
+    dst_demean = dst - dst_mean[:, :, None]
+
+    A = np.einsum('ntki,ntkj->ntij', dst_demean, lmk_demean) / lmk.shape[2]
+    d = np.ones(A.shape[:-1])
+    d[..., -1] = np.where(np.linalg.det(A) < 0, -1, 1)
+    U, S, V = np.linalg.svd(A)
+    # For rank deficient A (collinear landmarks) reflection is resolved by det(U) * det(V),
+    # same as in skimage. Original d is still used for scale.
+    tol = S.max(axis=-1) * max(A.shape[-2:]) * np.finfo(float).eps
+    rank = np.count_nonzero(S > tol[..., None], axis=-1)
+    d_rot = d.copy()
+    d_rot[..., -1] = np.where(rank == A.shape[-1] - 1,
+                              np.where(np.linalg.det(U) * np.linalg.det(V) > 0, 1, -1),
+                              d[..., -1])
+    R = U @ (d_rot[..., None] * V)
+    scale = (S * d).sum(axis=-1) / (lmk_demean ** 2).mean(axis=2).sum(axis=-1)
+
+    M = np.empty(R.shape[:-1] + (3,))
+    M[..., :2] = scale[..., None, None] * R
+    M[..., 2] = dst_mean - np.einsum('ntij,ntj->nti', M[..., :2], lmk_mean)
+
+    results = np.einsum('ntij,ntkj->ntki', M[..., :2], lmk) + M[..., None, :, 2]
+    error = np.sqrt(((results - dst) ** 2).sum(axis=-1)).sum(axis=-1)
+    min_index = np.argmin(error, axis=1)
+    min_M = M[np.arange(len(M)), min_index]
+    return min_M, min_index
+
+
+# Crop all faces from single source image into one preallocated (N, image_size, image_size, C) batch
+def norm_crop_batched(img, landmarks, image_size=112, mode='arcface'):
+    transforms, _ = estimate_norm_batched(np.asarray(landmarks).reshape(-1, 5, 2), image_size, mode)
+    crops = np.zeros((len(transforms), image_size, image_size) + img.shape[2:], dtype=img.dtype)
+    for i, M in enumerate(transforms):
+        cv2.warpAffine(img, M, (image_size, image_size), dst=crops[i], borderValue=0.0)
+    return crops
+
 def square_crop(im, S):
     if im.shape[0] > im.shape[1]:
         height = S